@@ -1,7 +1,7 @@
 import numpy as np 
 import matplotlib.pyplot as plt 
 
-import os, random, cv2, time 
+import os, shutil, cv2, time 
 
 
 
@@ -26,35 +26,87 @@ class ActionEnv:
         "right_click": 5
     }
     
-    def __init__(self):
+    def __init__(self, persistent_observation=False, observation_shape=None, layout="CHW", scenario_pool=None, seed=None):
+        """
+        If persistent_observation is set, the observations are composited into a frame
+        buffer that is kept for the lifetime of the env instead of copying the full canvas
+        on every step. The returned observation is then a read-only view of that buffer,
+        which is updated in place by the next step (copy it if it has to be kept).
+
+        observation_shape (h, w) and layout ("CHW" or "HWC") determine the format of the
+        observations. The scenario is rendered directly at that resolution, while the mouse
+        movement, rewards and evaluation still happen on the full canvas.
+
+        If a ScenarioPool is given, reset() takes its pre-generated scenarios instead of
+        generating them. The pool has to render at the same canvas shape and resolution.
+
+        All randomness of the env is drawn from generators derived from seed (see seed()).
+        """
         # initializet the scenario generator
         self.scenario_generator = ScenarioGenerator()
 
         # set the max allowed steps
         self.max_steps = 1000
 
-    def reset(self):
+        self.persistent_observation = persistent_observation
+        self.observation_shape = observation_shape
+        self.layout = layout
+        self.scenario_pool = scenario_pool
+        self._pool_slot = None
+        self._frame = None
+        self._frame_view = None
+
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        Re-seed the env. Separate generators for the scenarios and the mouse are spawned
+        from the seed, so the same seed always results in the same sequence of episodes.
+        """
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        scenario_seed, mouse_seed = seed_sequence.spawn(2)
+        self.scenario_generator.seed(scenario_seed)
+        self.rng = np.random.default_rng(mouse_seed)
+
+    def reset(self, seed=None):
         """
         Reset the environment. This will generate a new canvas with objects,
-        and re-initialize a mouse at a random location.
+        and re-initialize a mouse at a random location. If a seed is given,
+        the env is re-seeded first.
         """
+        if seed is not None:
+            self.seed(seed)
+
         # reset the step counter 
         self.step_counter = 0
 
-        # generate a new scenario
-        self.canvas, self.target_bounding_box, self.task_description, self.target_click_type = self.scenario_generator.generate_scenario()
+        # generate a new scenario (rendered at the observation resolution)
+        if self.scenario_pool is None:
+            self.canvas, self.target_bounding_box, self.task_description, self.target_click_type = self.scenario_generator.generate_scenario(
+                render_size=self.observation_shape
+            )
+        else:
+            # hand the canvas of the previous episode back and take the next pre-generated scenario
+            if self._pool_slot is not None:
+                self.scenario_pool.release(self._pool_slot)
+            self._pool_slot, self.canvas, self.target_bounding_box, self.task_description, self.target_click_type = self.scenario_pool.claim()
+        if self.layout == "HWC":
+            self.canvas = np.ascontiguousarray(self.canvas.transpose(1, 2, 0))
 
         # for ease of calculation, extract the center point of the target bounding box
         self.target_center = np.mean(self.target_bounding_box, axis=0)
 
         # initialize the mouse cursor
         self.mouse = Mouse(
-            canvas_shape=self.canvas.shape
+            canvas_shape=self.scenario_generator.canvas_shape,
+            observation_shape=self.observation_shape,
+            layout=self.layout,
+            rng=self.rng
         )
 
         # insert the mouse cursor into the canvas at a random position 
         self.mouse.get_random_position()
-        self.observation = self.mouse.get_observation(self.canvas)
+        self.observation = self._get_observation()
 
         # calculate the target distance for future reward calculation
         self.target_distance = self._get_distance()
@@ -90,7 +142,7 @@ class ActionEnv:
         info = self._evaluate() if done else None
 
         # get the new observation
-        self.observation = self.mouse.get_observation(self.canvas)
+        self.observation = self._get_observation()
 
         return self.observation, reward, done, info
     
@@ -98,11 +150,28 @@ class ActionEnv:
         """
         Use cv2 to render the canvas.
         """
-        cv2.imshow("ActionEnv", self.observation.transpose(1, 2, 0))
+        observation = self.observation if self.layout == "HWC" else self.observation.transpose(1, 2, 0)
+        cv2.imshow("ActionEnv", observation)
         cv2.waitKey(1)
         time.sleep(0.1)
 
 
+    def _get_observation(self):
+        """
+        Draw the mouse cursor onto the canvas, either into a fresh copy or into the persistent frame buffer.
+        """
+        if not self.persistent_observation:
+            return self.mouse.get_observation(self.canvas)
+
+        if self._frame is None or self._frame.shape != self.canvas.shape:
+            self._frame = np.empty_like(self.canvas)
+            self._frame_view = self._frame.view()
+            self._frame_view.flags.writeable = False
+
+        self.mouse.get_observation(self.canvas, out=self._frame)
+        return self._frame_view
+
+
     def _evaluate(self):
         """
         In addition to the intermediate rewards, this provides a binary reward at the end of the episode.
@@ -114,7 +183,7 @@ class ActionEnv:
             # the correct button is pressed
             # now check if the mouse is on the bounding box
             mouse_x, mouse_y = self.mouse.get_position()
-            if mouse_x > self.target_bounding_box[0, 1] and mouse_x < self.target_bounding_box[1, 1] and mouse_y > self.target_bounding_box[0, 0] and mouse_y < self.target_bounding_box[2, 0]:
+            if mouse_x > self.target_bounding_box[0, 1] and mouse_x < self.target_bounding_box[2, 1] and mouse_y > self.target_bounding_box[0, 0] and mouse_y < self.target_bounding_box[2, 0]:
                 return 1, self._get_distance()
 
         # if this code block is reached, the wrong button was pressed or the mouse was not on the bounding box
@@ -142,13 +211,236 @@ class ActionEnv:
 
 
 
+class BatchedActionEnv:
+    """
+    Vectorized version of the ActionEnv. N scenarios are held in a single (N, 3, H, W)
+    uint8 array and the mouse positions and click flags are stored as int/bool arrays,
+    so that moving, rewarding and evaluating all sub-environments is a handful of
+    numpy operations per step. Sub-environments that finish their episode are reset
+    automatically.
+
+    Note: the returned observations are a persistent buffer that is updated in place
+    on every step. Copy them if they need to be kept around.
+    """
+
+    action_space = ActionEnv.action_space
+    click_types = {"left": 0, "right": 1}
+
+    # mouse displacement per action (left, right, up, down, left click, right click)
+    move_x = np.array([-10, 10, 0, 0, 0, 0])
+    move_y = np.array([0, 0, -10, 10, 0, 0])
+
+    def __init__(self, num_envs, canvas_shape=(3, 768, 1366), seed=None):
+        self.num_envs = num_envs
+
+        # initialize the scenario generator
+        self.scenario_generator = ScenarioGenerator(canvas_shape=canvas_shape)
+
+        # set the max allowed steps
+        self.max_steps = 1000
+
+        # the cursor is identical for all sub-envs, so it only has to be loaded once.
+        # Store it channel last, since that is the layout of the gathered patches
+        mouse = Mouse(canvas_shape=canvas_shape)
+        self.cursor = mouse.cursor.transpose(1, 2, 0)
+        self.cursor_mask = mouse.cursor_mask.transpose(1, 2, 0)
+        cursor_h, cursor_w = self.cursor.shape[:2]
+        self.max_x = canvas_shape[2] - cursor_w
+        self.max_y = canvas_shape[1] - cursor_h
+
+        # preallocate the state of all sub-envs
+        self.canvases = np.zeros((num_envs, *canvas_shape), dtype=np.uint8)
+        self.observations = np.zeros_like(self.canvases)
+        self.target_bounding_boxes = np.zeros((num_envs, 4, 2), dtype=np.int64)
+        self.target_centers = np.zeros((num_envs, 2))
+        self.target_click_types = np.zeros(num_envs, dtype=np.int64)
+        self.target_distances = np.zeros(num_envs)
+        self.task_descriptions = [None] * num_envs
+
+        self.mouse_x = np.zeros(num_envs, dtype=np.int64)
+        self.mouse_y = np.zeros(num_envs, dtype=np.int64)
+        self.left_clicks = np.zeros(num_envs, dtype=bool)
+        self.right_clicks = np.zeros(num_envs, dtype=bool)
+        self.step_counters = np.zeros(num_envs, dtype=np.int64)
+
+        # position at which the cursor was last drawn into each observation
+        self._drawn_x = np.zeros(num_envs, dtype=np.int64)
+        self._drawn_y = np.zeros(num_envs, dtype=np.int64)
+
+        # index grids used to address all cursor patches at once
+        self._env_ids = np.arange(num_envs)
+        self._patch_y = np.arange(cursor_h)[np.newaxis, :, np.newaxis]
+        self._patch_x = np.arange(cursor_w)[np.newaxis, np.newaxis, :]
+
+        self.seed(seed)
+
+    def seed(self, seed=None):
+        """
+        Re-seed the env. Every sub-env gets its own generator spawned from the seed, so the
+        episodes of a sub-env do not depend on how many steps the other sub-envs took.
+        """
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        scenario_seed, *env_seeds = seed_sequence.spawn(self.num_envs + 1)
+        self.scenario_generator.seed(scenario_seed)
+        self.rngs = [np.random.default_rng(env_seed) for env_seed in env_seeds]
+
+    def reset(self, seed=None):
+        """
+        Reset all sub-environments. If a seed is given, the env is re-seeded first.
+        """
+        if seed is not None:
+            self.seed(seed)
+
+        self._reset_envs(self._env_ids)
+
+        # return the observations & tasks
+        return self.observations, list(self.task_descriptions)
+
+    def step(self, actions):
+        """
+        Given one action per sub-environment, move all mice at once and return the new
+        observations, rewards and done flags. Finished sub-environments are reset, in
+        which case their entry in the returned observations already belongs to the
+        new episode.
+        """
+        actions = np.asarray(actions)
+
+        # move the mice (clicks have a displacement of zero) and register the clicks
+        self.mouse_x = np.clip(self.mouse_x + self.move_x[actions], 0, self.max_x)
+        self.mouse_y = np.clip(self.mouse_y + self.move_y[actions], 0, self.max_y)
+        self.left_clicks |= actions == 4
+        self.right_clicks |= actions == 5
+
+        # increment step counts. Clicking or reaching the step limit finishes the episode
+        self.step_counters += 1
+        dones = (actions >= 4) | (self.step_counters >= self.max_steps)
+
+        # determine the rewards and the final evaluation of the finished sub-envs
+        rewards = self._get_rewards()
+        info = {
+            "success": np.where(dones, self._evaluate(), 0),
+            "final_distance": self.target_distances.copy(),
+        }
+
+        # get the new observations
+        self._draw_cursors(self._env_ids)
+
+        # start new episodes for all finished sub-envs
+        done_ids = np.flatnonzero(dones)
+        if len(done_ids):
+            self._reset_envs(done_ids)
+        info["task_descriptions"] = list(self.task_descriptions)
+
+        return self.observations, rewards, dones, info
+
+    def render(self, index=0):
+        """
+        Use cv2 to render the canvas of one of the sub-environments.
+        """
+        cv2.imshow("BatchedActionEnv", self.observations[index].transpose(1, 2, 0))
+        cv2.waitKey(1)
+        time.sleep(0.1)
+
+    def _reset_envs(self, env_ids):
+        """
+        Generate new scenarios for the given sub-envs and place their mice at random positions.
+        """
+        for i in env_ids:
+            # draw the new scenario directly into the shared canvas array
+            _, target_bounding_box, task_description, click_type = self.scenario_generator.generate_scenario(
+                canvas=self.canvases[i],
+                rng=self.rngs[i]
+            )
+            self.target_bounding_boxes[i] = target_bounding_box
+            self.target_click_types[i] = self.click_types[click_type]
+            self.task_descriptions[i] = task_description
+
+            # the observation has to be rebuilt completely once per episode
+            self.observations[i] = self.canvases[i]
+
+            # initialize the mouse at a random position
+            self.mouse_x[i] = self.rngs[i].integers(0, self.max_x)
+            self.mouse_y[i] = self.rngs[i].integers(0, self.max_y)
+
+        self.target_centers[env_ids] = self.target_bounding_boxes[env_ids].mean(axis=1)
+        self.step_counters[env_ids] = 0
+        self.left_clicks[env_ids] = False
+        self.right_clicks[env_ids] = False
+
+        # the fresh observations do not contain a cursor yet, so there is nothing to restore
+        self._drawn_x[env_ids] = self.mouse_x[env_ids]
+        self._drawn_y[env_ids] = self.mouse_y[env_ids]
+        self._draw_cursors(env_ids)
+
+        # calculate the target distance for future reward calculation
+        self.target_distances[env_ids] = self._get_distances()[env_ids]
+
+    def _draw_cursors(self, env_ids):
+        """
+        Update the cursor in the observations of the given sub-envs. Instead of copying
+        the full canvases, only the patches covered by the previous and the new cursor
+        positions are touched.
+        """
+        env_idx = env_ids[:, np.newaxis, np.newaxis]
+
+        # restore the patches covered by the previously drawn cursors
+        rows = self._drawn_y[env_ids, np.newaxis, np.newaxis] + self._patch_y
+        cols = self._drawn_x[env_ids, np.newaxis, np.newaxis] + self._patch_x
+        self.observations[env_idx, :, rows, cols] = self.canvases[env_idx, :, rows, cols]
+
+        # blend the cursors into the patches at the new positions
+        rows = self.mouse_y[env_ids, np.newaxis, np.newaxis] + self._patch_y
+        cols = self.mouse_x[env_ids, np.newaxis, np.newaxis] + self._patch_x
+        patches = self.canvases[env_idx, :, rows, cols]
+        self.observations[env_idx, :, rows, cols] = np.where(self.cursor_mask, self.cursor, patches)
+
+        self._drawn_x[env_ids] = self.mouse_x[env_ids]
+        self._drawn_y[env_ids] = self.mouse_y[env_ids]
+
+    def _evaluate(self):
+        """
+        Vectorized version of ActionEnv._evaluate. Returns a binary array that is 1 where
+        the correct button was clicked while the mouse is on the target bounding box.
+        """
+        correct_button = np.where(self.target_click_types == self.click_types["left"], self.left_clicks, self.right_clicks)
+        bounding_boxes = self.target_bounding_boxes
+        on_target = (
+            (self.mouse_x > bounding_boxes[:, 0, 1]) & (self.mouse_x < bounding_boxes[:, 2, 1]) &
+            (self.mouse_y > bounding_boxes[:, 0, 0]) & (self.mouse_y < bounding_boxes[:, 2, 0])
+        )
+        return (correct_button & on_target).astype(np.int64)
+
+    def _get_distances(self):
+        """
+        Get the current distances between the mice and the centers of the target icons.
+        """
+        return np.sqrt((self.mouse_x - self.target_centers[:, 1])**2 + (self.mouse_y - self.target_centers[:, 0])**2)
+
+    def _get_rewards(self):
+        """
+        The current rewards depend on an improved distance to the target icons.
+        """
+        new_target_distances = self._get_distances()
+        rewards = self.target_distances - new_target_distances
+        self.target_distances = new_target_distances
+        return rewards
+
+
+
+
+
 class Mouse:
-    def __init__(self, canvas_shape):
+    def __init__(self, canvas_shape, observation_shape=None, layout="CHW", rng=None):
+        """
+        The mouse moves on a canvas of canvas_shape (3, H, W). Observations can be rendered
+        at a different (h, w) observation_shape, in which case the cursor is scaled and drawn
+        at the scaled position, and in either CHW or HWC layout.
+        """
         self.x = None 
         self.y = None 
         self.left_click = False
         self.right_click = False
-
+        self.rng = np.random.default_rng() if rng is None else rng
 
         self.file_path = os.path.join("data", "mouse-cursor.png")
 
@@ -169,9 +461,22 @@ class Mouse:
 
         self.canvas_shape = canvas_shape[1:]
 
+        # prepare the cursor that is drawn into the observations
+        if observation_shape is None:
+            observation_shape = self.canvas_shape
+        self.observation_scale = (observation_shape[0] / self.canvas_shape[0], observation_shape[1] / self.canvas_shape[1])
+        self.observation_shape = observation_shape
+        self.channels_last = layout == "HWC"
+        self.observation_cursor, self.observation_cursor_mask = self._get_observation_cursor()
+
+        # frame buffer, canvas and position of the last cursor drawn via get_observation(out=...)
+        self._drawn_frame = None
+        self._drawn_canvas = None
+        self._drawn_position = None
+
     def get_random_position(self):
-        self.x = np.random.randint(0, self.canvas_shape[1] - self.cursor.shape[2])
-        self.y = np.random.randint(0, self.canvas_shape[0] - self.cursor.shape[1])
+        self.x = self.rng.integers(0, self.canvas_shape[1] - self.cursor.shape[2])
+        self.y = self.rng.integers(0, self.canvas_shape[0] - self.cursor.shape[1])
 
 
     def move_mouse(self, action):
@@ -203,72 +508,280 @@ class Mouse:
         return self.left_click, self.right_click
 
 
-    def get_observation(self, canvas):
-        local_canvas = canvas.copy()
-        local_canvas[:, self.y:self.y+self.cursor.shape[1], self.x:self.x+self.cursor.shape[2]] = self.cursor*self.cursor_mask + local_canvas[:, self.y:self.y+self.cursor.shape[1], self.x:self.x+self.cursor.shape[2]] * (~self.cursor_mask)
-        return local_canvas
+    def get_observation(self, canvas, out=None):
+        """
+        Return the canvas with the cursor drawn on top of it. The canvas has to be of the
+        observation shape and layout of the mouse.
+
+        If an out buffer is given, no new array is allocated. As long as the same canvas
+        and buffer are passed in, only the patch covered by the previously drawn cursor
+        is restored from the canvas and the cursor is blended into the new patch. The
+        buffer must not be modified by the caller in between calls.
+        """
+        y, x = self._get_observation_position()
+
+        if out is None:
+            local_canvas = canvas.copy()
+            np.copyto(self._get_patch(local_canvas, y, x), self.observation_cursor, where=self.observation_cursor_mask)
+            return local_canvas
 
+        if out is self._drawn_frame and canvas is self._drawn_canvas:
+            # restore the patch covered by the previous cursor
+            drawn_y, drawn_x = self._drawn_position
+            self._get_patch(out, drawn_y, drawn_x)[...] = self._get_patch(canvas, drawn_y, drawn_x)
+        else:
+            # new canvas or buffer, so the full frame has to be copied once
+            np.copyto(out, canvas)
 
+        # blend the cursor into the dirty region only
+        np.copyto(self._get_patch(out, y, x), self.observation_cursor, where=self.observation_cursor_mask)
 
+        self._drawn_frame = out
+        self._drawn_canvas = canvas
+        self._drawn_position = (y, x)
+        return out
 
-class Icons:
-    def __init__(self):
-        dataset_path = os.path.join(
-            "data", "Icons-50"
-        )
-        # load the dataset labels with numpy 
-        icons = np.load(os.path.join(dataset_path, "Icons-50.npy"), allow_pickle=True).item()
+    def _get_observation_cursor(self):
+        """
+        Scale the cursor and its mask to the observation resolution and bring them into the observation layout.
+        """
+        cursor, cursor_mask = self.cursor, self.cursor_mask
+        if self.observation_scale != (1.0, 1.0):
+            cursor_h = max(1, int(round(cursor.shape[1] * self.observation_scale[0])))
+            cursor_w = max(1, int(round(cursor.shape[2] * self.observation_scale[1])))
+            cursor = cv2.resize(cursor.transpose(1, 2, 0), dsize=(cursor_w, cursor_h), interpolation=cv2.INTER_AREA).transpose(2, 0, 1)
+            cursor_mask = cv2.resize(cursor_mask[0].astype(np.uint8), dsize=(cursor_w, cursor_h), interpolation=cv2.INTER_NEAREST)[np.newaxis] > 0
+
+        if self.channels_last:
+            return np.ascontiguousarray(cursor.transpose(1, 2, 0)), np.ascontiguousarray(cursor_mask.transpose(1, 2, 0))
+        return cursor, cursor_mask
+
+    def _get_observation_position(self):
+        """
+        Map the mouse position onto the observation resolution.
+        """
+        if self.observation_scale == (1.0, 1.0):
+            return self.y, self.x
 
-        # create dict of dict with idx as key and class and image as values
-        self.icons = {
-            str(idx): {"class": class_, "image": image_} for idx, (class_, image_) in enumerate(zip(icons['subtype'], icons['image']))
+        cursor_h, cursor_w = self.observation_cursor.shape[:2] if self.channels_last else self.observation_cursor.shape[1:]
+        y = min(int(self.y * self.observation_scale[0]), self.observation_shape[0] - cursor_h)
+        x = min(int(self.x * self.observation_scale[1]), self.observation_shape[1] - cursor_w)
+        return y, x
+
+    def _get_patch(self, frame, y, x):
+        """
+        Return a view of the region of the frame that the cursor covers at the given position.
+        """
+        if self.channels_last:
+            cursor_h, cursor_w = self.observation_cursor.shape[:2]
+            return frame[y:y+cursor_h, x:x+cursor_w]
+        cursor_h, cursor_w = self.observation_cursor.shape[1:]
+        return frame[:, y:y+cursor_h, x:x+cursor_w]
+
+
+
+
+def scale_icon(icon, scale):
+    """
+    Resize a (3, h, w) icon by the given (y, x) scale factors.
+    """
+    scaled_size = (max(1, int(round(icon.shape[1] * scale[0]))), max(1, int(round(icon.shape[2] * scale[1]))))
+    scaled_icon = cv2.resize(np.ascontiguousarray(icon.transpose(1, 2, 0)), dsize=(scaled_size[1], scaled_size[0]), interpolation=cv2.INTER_AREA)
+    return scaled_icon.reshape(*scaled_size, -1).transpose(2, 0, 1)
+
+
+def _pack_images(images, target_path, suffix=""):
+    """
+    Write a list of (3, h, w) uint8 images as one contiguous array plus offsets and shapes.
+    """
+    shapes = np.array([image.shape for image in images], dtype=np.int32)
+    offsets = np.zeros(len(images) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(np.prod(shapes, axis=1))
+
+    packed = np.lib.format.open_memmap(os.path.join(target_path, f"images{suffix}.npy"), mode="w+", dtype=np.uint8, shape=(int(offsets[-1]),))
+    for image, start, end in zip(images, offsets[:-1], offsets[1:]):
+        packed[start:end] = np.asarray(image, dtype=np.uint8).ravel()
+    packed.flush()
+    del packed
+
+    np.save(os.path.join(target_path, f"offsets{suffix}.npy"), offsets)
+    np.save(os.path.join(target_path, f"shapes{suffix}.npy"), shapes)
+
+
+def _scale_suffix(scale):
+    return "_{:.6f}x{:.6f}".format(*scale)
+
+
+def convert_icons(dataset_path=os.path.join("data", "Icons-50"), render_sizes=(), canvas_shape=(3, 768, 1366)):
+    """
+    One-time conversion of the pickled Icons-50.npy into a memory-mappable store in
+    dataset_path/packed. All icons are packed into a single contiguous uint8 array,
+    next to their offsets, shapes, class ids and a class name table. For every render
+    size (h, w) an additional pre-scaled copy of the icons is written, matching the
+    scaling that ScenarioGenerator applies when rendering at that size.
+    """
+    icons = np.load(os.path.join(dataset_path, "Icons-50.npy"), allow_pickle=True).item()
+    images = list(icons['image'])
+    class_names, class_ids = np.unique(np.asarray(icons['subtype'], dtype=str), return_inverse=True)
+
+    # write into a temporary directory first, so that readers never see a partial store
+    target_path = os.path.join(dataset_path, "packed")
+    tmp_path = f"{target_path}.tmp{os.getpid()}"
+    os.makedirs(tmp_path, exist_ok=True)
+
+    _pack_images(images, tmp_path)
+    np.save(os.path.join(tmp_path, "class_ids.npy"), class_ids.astype(np.int32))
+    np.save(os.path.join(tmp_path, "class_names.npy"), class_names)
+
+    scales = [(h / canvas_shape[1], w / canvas_shape[2]) for h, w in render_sizes]
+    for scale in scales:
+        _pack_images([scale_icon(image, scale) for image in images], tmp_path, suffix=_scale_suffix(scale))
+    np.save(os.path.join(tmp_path, "scales.npy"), np.array(scales, dtype=np.float64).reshape(-1, 2))
+
+    if os.path.exists(target_path):
+        shutil.rmtree(target_path)
+    os.replace(tmp_path, target_path)
+    return target_path
+
+
+class Icons:
+    """
+    Memory-mapped view of the Icons-50 dataset. The packed store is created from
+    Icons-50.npy on first use (see convert_icons). Since the images are memory-mapped,
+    loading is nearly instant and forked workers share the same pages.
+    """
+    def __init__(self, dataset_path=os.path.join("data", "Icons-50")):
+        packed_path = os.path.join(dataset_path, "packed")
+        if not os.path.exists(packed_path):
+            convert_icons(dataset_path)
+
+        # load the packed icons as memory maps
+        self.images = np.load(os.path.join(packed_path, "images.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(packed_path, "offsets.npy"))
+        self.shapes = np.load(os.path.join(packed_path, "shapes.npy"))
+        self.class_ids = np.load(os.path.join(packed_path, "class_ids.npy"))
+        self.class_names = np.load(os.path.join(packed_path, "class_names.npy"))
+
+        # load the pre-scaled icon variants
+        self.scaled = {}
+        for scale in np.load(os.path.join(packed_path, "scales.npy")):
+            suffix = _scale_suffix(scale)
+            self.scaled[suffix] = (
+                np.load(os.path.join(packed_path, f"images{suffix}.npy"), mmap_mode="r"),
+                np.load(os.path.join(packed_path, f"offsets{suffix}.npy")),
+                np.load(os.path.join(packed_path, f"shapes{suffix}.npy")),
+            )
+
+    def __len__(self):
+        return len(self.shapes)
+
+    def get_icon(self, idx):
+        return {
+            "id": idx,
+            "class": self.class_names[self.class_ids[idx]],
+            "image": self.images[self.offsets[idx]:self.offsets[idx+1]].reshape(self.shapes[idx])
         }
 
+    def get_rndm_icon(self, rng):
+        rndm_idx = rng.integers(0, len(self))
+        return self.get_icon(rndm_idx)
 
-    def get_rndm_icon(self):
-        rndm_idx = np.random.randint(0, len(self.icons))
-        return self.icons[str(rndm_idx)]
+    def get_scaled_image(self, idx, scale):
+        """
+        Return the icon scaled by the (y, x) scale factors, using the pre-scaled copy if one was converted.
+        """
+        suffix = _scale_suffix(scale)
+        if suffix in self.scaled:
+            images, offsets, shapes = self.scaled[suffix]
+            return images[offsets[idx]:offsets[idx+1]].reshape(shapes[idx])
+        return scale_icon(self.get_icon(idx)["image"], scale)
 
 class Backgrounds:
     """
     The purpose of this class is to generate random monochrome backgrounds of a specified size
     """
-    def __init__(self):
+    def __init__(self, rng=None):
+        rng = np.random.default_rng() if rng is None else rng
+
         # create a list of random colors represented in int8 RGB
-        self.colours = np.random.randint(0, 255, size=(1000, 3), dtype=np.uint8)
+        self.colours = rng.integers(0, 255, size=(1000, 3), dtype=np.uint8)
 
-    def generate_background(self, size=(3, 768, 1366)):
-        return np.ones(size, dtype=np.uint8) * self.colours[np.random.randint(0, 1000)].reshape((3, 1, 1))
+    def get_rndm_colour(self, rng):
+        return self.colours[rng.integers(0, 1000)]
 
+    def generate_background(self, colour, size=(3, 768, 1366), out=None):
+        colour = np.asarray(colour, dtype=np.uint8).reshape((3, 1, 1))
+        if out is None:
+            return np.ones(size, dtype=np.uint8) * colour
 
+        # fill the given canvas in place (used by the batched env to avoid re-allocating)
+        out[...] = colour
+        return out
 
-class ScenarioGenerator:
-    def __init__(self):
-        self.icons = Icons()
-        self.backgrounds = Backgrounds()
-
-    def generate_scenario(self, num_background_icons=None):
-        # determine number of noise items
-        if num_background_icons is None:
-            num_background_icons = np.random.randint(1, 15)
 
-        # generate background
-        canvas = self.backgrounds.generate_background()
 
-        # place the background icons randomly on the canvas
-        for _ in range(num_background_icons):
-            icon = self.icons.get_rndm_icon()['image']
-            canvas, _ = self._place_icon_on_canvas(canvas, icon)
+class ScenarioGenerator:
+    """
+    Generating a scenario is split into two parts. sample_scenario() draws a compact
+    recipe (background colour, icon ids and positions, task template), from which
+    render_scenario() and describe_scenario() deterministically build the canvas and
+    the target bounding box / task description. generate_scenario() does both.
+    """
 
-        # place the target icon randomly on the canvas
-        target_icon = self.icons.get_rndm_icon()
-        canvas, target_bounding_box = self._place_icon_on_canvas(canvas, target_icon['image'])
+    # Base phrases that can be used to construct the instruction
+    task_templates = [
+        ("left click on the {icon}", 'left'),
+        ("right click on the {icon}", 'right'),
+        ("Please select the {icon} by clicking it", 'left'),
+        ("Go ahead and left click on the {icon}", 'left'),
+        ("Go ahead and right click on the {icon}", 'right'),
+        ("Use the mouse to select the {icon}", 'left'),
+        ("Find and left click on the {icon}", 'left'),
+        ("Find and right click on the {icon}", 'right'),
+        ("Choose the {icon} with a right click", 'right'),
+        ("Interact with the {icon} by left clicking it", 'left'),
+        ("Interact with the {icon} by right clicking it", 'right'),
+        ("Point and left click on the {icon}", 'left'), 
+        ("Point and right click on the {icon}", 'right'),
+        ("Activate the {icon} by left clicking", 'left'),
+        ("Direct your left click towards the {icon}", 'left'),
+        ("Direct your right click towards the {icon}", 'right'),
+        ("Move the mouse to {icon} and left click", 'left'),
+        ("Move the mouse to {icon} and right click", 'right'),
+        ("Click on the {icon} to continue", 'left'),
+        ("Click on the {icon} to proceed", 'left'),
+        ('Select the {icon} to continue', 'left'),
+    ]
+
+    def __init__(self, canvas_shape=(3, 768, 1366), seed=None):
+        self.icons = Icons()
+        self.canvas_shape = canvas_shape
+        self.seed(seed)
 
+    def seed(self, seed=None):
+        """
+        Re-seed the generator. Accepts anything np.random.SeedSequence accepts, or a SeedSequence
+        (e.g. spawned for a parallel worker). This also re-creates the background colours.
+        """
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        background_seed, scenario_seed = seed_sequence.spawn(2)
+        self.backgrounds = Backgrounds(rng=np.random.default_rng(background_seed))
+        self.rng = np.random.default_rng(scenario_seed)
 
+    def generate_scenario(self, num_background_icons=None, canvas=None, render_size=None, rng=None):
+        """
+        Generate a new canvas with icons on it. If a canvas is given, the scenario
+        is drawn into it in place rather than into a newly allocated array.
 
-        # convert the target class into a natural language task description
-        task_description, click_type = self._generate_task_description(target_icon['class'])
+        If render_size (h, w) is given, the canvas is rendered at that resolution instead.
+        Icon positions and the returned bounding box still refer to the full canvas_shape,
+        only the icons are scaled and placed at the scaled positions.
 
+        All random draws use the given generator, or the generator of the ScenarioGenerator.
+        """
+        scenario = self.sample_scenario(num_background_icons, rng=rng)
+        canvas = self.render_scenario(scenario, canvas=canvas, render_size=render_size)
+        target_bounding_box, task_description, click_type = self.describe_scenario(scenario)
 
         if False:
             print(target_bounding_box)
@@ -278,58 +791,107 @@ class ScenarioGenerator:
 
         return canvas, target_bounding_box, task_description, click_type
 
+    def sample_scenario(self, num_background_icons=None, rng=None):
+        """
+        Draw the recipe of a new scenario. The target icon is the last of the icons.
+        """
+        rng = self.rng if rng is None else rng
+
+        # determine number of noise items
+        if num_background_icons is None:
+            num_background_icons = rng.integers(1, 15)
+
+        # pick the background colour
+        colour = self.backgrounds.get_rndm_colour(rng)
+
+        # pick the background icons and the target icon, each at a random position on the canvas
+        icon_ids, positions = [], []
+        for _ in range(num_background_icons + 1):
+            icon = self.icons.get_rndm_icon(rng)
+            icon_ids.append(icon['id'])
+            positions.append(self._get_rndm_position(icon['image'].shape[1:], rng))
+
+        # pick the task template
+        template_id = rng.integers(0, len(self.task_templates))
+
+        return {
+            "colour": colour,
+            "icon_ids": np.array(icon_ids),
+            "positions": np.array(positions),
+            "template_id": template_id
+        }
+
+    def render_scenario(self, scenario, canvas=None, render_size=None):
+        """
+        Draw the canvas of a scenario recipe (see generate_scenario for canvas and render_size).
+        """
+        scale = None
+        size = self.canvas_shape
+        if render_size is not None and tuple(render_size) != tuple(self.canvas_shape[1:]):
+            scale = (render_size[0] / self.canvas_shape[1], render_size[1] / self.canvas_shape[2])
+            size = (self.canvas_shape[0], *render_size)
+
+        # generate background
+        canvas = self.backgrounds.generate_background(scenario['colour'], size=size, out=canvas)
+
+        # place the background icons and then the target icon on the canvas
+        for icon_id, position in zip(scenario['icon_ids'], scenario['positions']):
+            canvas = self._place_icon_on_canvas(canvas, self.icons.get_icon(icon_id), position, scale=scale)
+
+        return canvas
+
+    def describe_scenario(self, scenario):
+        """
+        Return the target bounding box, task description and click type of a scenario recipe.
+        """
+        target_icon = self.icons.get_icon(scenario['icon_ids'][-1])
+        target_bounding_box = self._get_bounding_box(scenario['positions'][-1], target_icon['image'].shape[1:])
+
+        # convert the target class into a natural language task description
+        task_description, click_type = self._generate_task_description(target_icon['class'], scenario['template_id'])
+
+        return target_bounding_box, task_description, click_type
 
-    def _place_icon_on_canvas(self, canvas, icon):
-        # get icon size
-        icon_size = icon.shape[1:]
 
+    def _get_rndm_position(self, icon_size, rng):
         # get canvas size
-        canvas_size = canvas.shape[1:]
+        canvas_size = self.canvas_shape[1:]
 
         # get random position on canvas
-        x = np.random.randint(0, canvas_size[0] - icon_size[0])
-        y = np.random.randint(0, canvas_size[1] - icon_size[1])
+        x = rng.integers(0, canvas_size[0] - icon_size[0])
+        y = rng.integers(0, canvas_size[1] - icon_size[1])
+        return x, y
 
-        # place icon on canvas
-        canvas[:, x:x+icon_size[0], y:y+icon_size[1]] = icon
+    def _place_icon_on_canvas(self, canvas, icon, position, scale=None):
+        # get icon size and position
+        icon_size = icon['image'].shape[1:]
+        x, y = position
 
-        icon_bounding_box = np.array([
+        # place icon on canvas
+        if scale is None:
+            canvas[:, x:x+icon_size[0], y:y+icon_size[1]] = icon['image']
+        else:
+            # the canvas is rendered at a lower resolution, so scale the icon and its position
+            scaled_icon = self.icons.get_scaled_image(icon['id'], scale)
+            scaled_size = scaled_icon.shape[1:]
+            scaled_x = min(int(x * scale[0]), canvas.shape[1] - scaled_size[0])
+            scaled_y = min(int(y * scale[1]), canvas.shape[2] - scaled_size[1])
+            canvas[:, scaled_x:scaled_x+scaled_size[0], scaled_y:scaled_y+scaled_size[1]] = scaled_icon
+
+        return canvas
+
+    def _get_bounding_box(self, position, icon_size):
+        x, y = position
+        return np.array([
             [x, y],
             [x+icon_size[0], y],
             [x+icon_size[0], y+icon_size[1]],
             [x, y+icon_size[1]]
         ])
-
-        return canvas, icon_bounding_box
     
-    def _generate_task_description(self, target_class):
-        # Base phrases that can be used to construct the instruction
-        base_phrases = [
-            ("left click on the {icon}", 'left'),
-            ("right click on the {icon}", 'right'),
-            ("Please select the {icon} by clicking it", 'left'),
-            ("Go ahead and left click on the {icon}", 'left'),
-            ("Go ahead and right click on the {icon}", 'right'),
-            ("Use the mouse to select the {icon}", 'left'),
-            ("Find and left click on the {icon}", 'left'),
-            ("Find and right click on the {icon}", 'right'),
-            ("Choose the {icon} with a right click", 'right'),
-            ("Interact with the {icon} by left clicking it", 'left'),
-            ("Interact with the {icon} by right clicking it", 'right'),
-            ("Point and left click on the {icon}", 'left'), 
-            ("Point and right click on the {icon}", 'right'),
-            ("Activate the {icon} by left clicking", 'left'),
-            ("Direct your left click towards the {icon}", 'left'),
-            ("Direct your right click towards the {icon}", 'right'),
-            ("Move the mouse to {icon} and left click", 'left'),
-            ("Move the mouse to {icon} and right click", 'right'),
-            ("Click on the {icon} to continue", 'left'),
-            ("Click on the {icon} to proceed", 'left'),
-            ('Select the {icon} to continue', 'left'),
-        ]
-
+    def _generate_task_description(self, target_class, template_id):
         # generate the instruction
-        instruction_base, click_type = random.choice(base_phrases)
+        instruction_base, click_type = self.task_templates[template_id]
         return instruction_base.format(
             icon=target_class.lower().replace("_", " ")
         ), click_type
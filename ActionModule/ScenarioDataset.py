@@ -0,0 +1,205 @@
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+
+import argparse, json, os
+
+from ActionEnv import ScenarioGenerator
+
+
+
+class ScenarioDatasetWriter:
+    """
+    Writes scenario recipes (see ScenarioGenerator.sample_scenario) into a directory
+    of raw, column-wise binary files. Canvases are not stored, only what is needed to
+    render them again: the background colour, the icon ids (indices into the packed
+    Icons store) and positions, the task template, target bounding box and click type.
+
+    Records are buffered and appended to the column files in chunks, so writing
+    millions of scenarios needs constant memory. The dtypes and shapes of the columns
+    are stored in meta.json once the writer is closed.
+    """
+
+    # per scenario columns
+    scenario_columns = {
+        "colours": (np.uint8, (3,)),
+        "num_icons": (np.uint16, ()),
+        "template_ids": (np.uint8, ()),
+        "click_types": (np.uint8, ()),
+        "target_bounding_boxes": (np.int16, (4, 2)),
+    }
+    # per icon columns
+    icon_columns = {
+        "icon_ids": (np.int32, ()),
+        "icon_positions": (np.int16, (2,)),
+    }
+    click_types = {"left": 0, "right": 1}
+
+    def __init__(self, path, canvas_shape=(3, 768, 1366), num_icon_images=None, chunk_size=10_000):
+        self.path = path
+        self.canvas_shape = canvas_shape
+        self.num_icon_images = num_icon_images
+        self.chunk_size = chunk_size
+
+        self.num_scenarios = 0
+        self.num_icons = 0
+        self._buffers = {name: [] for name in {**self.scenario_columns, **self.icon_columns}}
+
+        # start with empty column files
+        os.makedirs(path, exist_ok=True)
+        for name in self._buffers:
+            open(os.path.join(path, f"{name}.bin"), "wb").close()
+
+    def write(self, scenario, target_bounding_box, click_type):
+        self._buffers["colours"].append(scenario['colour'])
+        self._buffers["num_icons"].append(len(scenario['icon_ids']))
+        self._buffers["template_ids"].append(scenario['template_id'])
+        self._buffers["click_types"].append(self.click_types[click_type])
+        self._buffers["target_bounding_boxes"].append(target_bounding_box)
+        self._buffers["icon_ids"].extend(scenario['icon_ids'])
+        self._buffers["icon_positions"].extend(scenario['positions'])
+
+        if len(self._buffers["colours"]) >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Append the buffered records to the column files.
+        """
+        self.num_scenarios += len(self._buffers["colours"])
+        self.num_icons += len(self._buffers["icon_ids"])
+
+        for name, (dtype, shape) in {**self.scenario_columns, **self.icon_columns}.items():
+            if not self._buffers[name]:
+                continue
+            column = np.asarray(self._buffers[name], dtype=dtype).reshape(-1, *shape)
+            with open(os.path.join(self.path, f"{name}.bin"), "ab") as f:
+                f.write(column.tobytes())
+            self._buffers[name] = []
+
+    def close(self):
+        self.flush()
+        meta = {
+            "version": 1,
+            "canvas_shape": list(self.canvas_shape),
+            "num_icon_images": self.num_icon_images,
+            "num_scenarios": self.num_scenarios,
+            "num_icons": self.num_icons,
+            "columns": {
+                name: {"dtype": np.dtype(dtype).str, "shape": list(shape)}
+                for name, (dtype, shape) in {**self.scenario_columns, **self.icon_columns}.items()
+            },
+        }
+        with open(os.path.join(self.path, "meta.json"), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+
+class ScenarioDataset:
+    """
+    Read-only access to a dataset written by ScenarioDatasetWriter. The columns are
+    memory-mapped and canvases are only rendered when they are requested, either one
+    at a time via indexing or in parallel via render_batch().
+    """
+    def __init__(self, path):
+        with open(os.path.join(path, "meta.json")) as f:
+            self.meta = json.load(f)
+
+        # memory-map all columns
+        lengths = {name: self.meta["num_scenarios"] for name in ScenarioDatasetWriter.scenario_columns}
+        lengths.update({name: self.meta["num_icons"] for name in ScenarioDatasetWriter.icon_columns})
+        self.columns = {
+            name: np.memmap(
+                os.path.join(path, f"{name}.bin"),
+                dtype=column["dtype"],
+                mode="r",
+                shape=(lengths[name], *column["shape"])
+            ) if lengths[name] else np.zeros((0, *column["shape"]), dtype=column["dtype"])
+            for name, column in self.meta["columns"].items()
+        }
+
+        # offsets of the icons of every scenario in the icon columns
+        self.icon_offsets = np.zeros(len(self) + 1, dtype=np.int64)
+        np.cumsum(self.columns["num_icons"], out=self.icon_offsets[1:])
+
+        # the renderer (the icon ids refer to the packed Icons store)
+        self.scenario_generator = ScenarioGenerator(canvas_shape=tuple(self.meta["canvas_shape"]))
+        if self.meta["num_icon_images"] is not None and self.meta["num_icon_images"] != len(self.scenario_generator.icons):
+            raise ValueError("The dataset was written for a different Icons store")
+
+        self.click_types = {value: key for key, value in ScenarioDatasetWriter.click_types.items()}
+
+    def __len__(self):
+        return self.meta["num_scenarios"]
+
+    def __getitem__(self, idx):
+        return self.get_scenario(idx)
+
+    def get_recipe(self, idx):
+        start, end = self.icon_offsets[idx], self.icon_offsets[idx + 1]
+        return {
+            "colour": self.columns["colours"][idx],
+            "icon_ids": self.columns["icon_ids"][start:end],
+            "positions": self.columns["icon_positions"][start:end],
+            "template_id": self.columns["template_ids"][idx]
+        }
+
+    def get_scenario(self, idx, canvas=None, render_size=None):
+        """
+        Render a stored scenario. Returns the same tuple as ScenarioGenerator.generate_scenario.
+        """
+        recipe = self.get_recipe(idx)
+        canvas = self.scenario_generator.render_scenario(recipe, canvas=canvas, render_size=render_size)
+        _, task_description, _ = self.scenario_generator.describe_scenario(recipe)
+        target_bounding_box = self.columns["target_bounding_boxes"][idx].astype(np.int64)
+        click_type = self.click_types[self.columns["click_types"][idx]]
+        return canvas, target_bounding_box, task_description, click_type
+
+    def render_batch(self, indices, render_size=None, num_workers=4, out=None):
+        """
+        Render the canvases of several scenarios in parallel into one (N, 3, H, W) array.
+        Returns the canvases, target bounding boxes, task descriptions and click types.
+        """
+        shape = self.meta["canvas_shape"] if render_size is None else (self.meta["canvas_shape"][0], *render_size)
+        if out is None:
+            out = np.empty((len(indices), *shape), dtype=np.uint8)
+
+        # the heavy lifting (filling and copying arrays) releases the GIL, so threads suffice
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            scenarios = list(executor.map(
+                lambda item: self.get_scenario(item[1], canvas=out[item[0]], render_size=render_size),
+                enumerate(indices)
+            ))
+
+        _, target_bounding_boxes, task_descriptions, click_types = zip(*scenarios)
+        return out, np.stack(target_bounding_boxes), list(task_descriptions), list(click_types)
+
+
+
+def export_scenarios(path, num_scenarios, canvas_shape=(3, 768, 1366), seed=None, chunk_size=10_000):
+    """
+    Sample num_scenarios scenarios and write their recipes to path. No canvas is rendered.
+    """
+    scenario_generator = ScenarioGenerator(canvas_shape=canvas_shape, seed=seed)
+    with ScenarioDatasetWriter(path, canvas_shape, num_icon_images=len(scenario_generator.icons), chunk_size=chunk_size) as writer:
+        for _ in range(num_scenarios):
+            scenario = scenario_generator.sample_scenario()
+            target_bounding_box, _, click_type = scenario_generator.describe_scenario(scenario)
+            writer.write(scenario, target_bounding_box, click_type)
+
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export ActionEnv scenarios to a binary dataset.")
+    parser.add_argument("path")
+    parser.add_argument("--num-scenarios", type=int, default=100_000)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    export_scenarios(args.path, args.num_scenarios, seed=args.seed)
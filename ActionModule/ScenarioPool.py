@@ -0,0 +1,145 @@
+import numpy as np
+
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import queue
+
+from ActionEnv import ScenarioGenerator
+
+
+
+def _scenario_worker(shm_name, slots_shape, canvas_shape, render_size, generator_seed, scenario_seed, task_queue, ready_queue):
+    """
+    Worker process of the ScenarioPool. Renders the requested scenarios into the
+    shared memory slots and reports the remaining scenario information back.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray(slots_shape, dtype=np.uint8, buffer=shm.buf)
+
+    # all workers share the same seed for the generator, so they use the same background colours
+    scenario_generator = ScenarioGenerator(canvas_shape=canvas_shape, seed=generator_seed)
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        index, slot = task
+
+        # every scenario gets its own child of the seed sequence, so that the result
+        # does not depend on which worker picks it up
+        rng = np.random.default_rng(
+            np.random.SeedSequence(scenario_seed.entropy, spawn_key=scenario_seed.spawn_key + (index,))
+        )
+        _, target_bounding_box, task_description, click_type = scenario_generator.generate_scenario(
+            canvas=slots[slot],
+            render_size=render_size,
+            rng=rng
+        )
+        ready_queue.put((index, slot, target_bounding_box, task_description, click_type))
+
+    del slots
+    shm.close()
+
+
+
+class ScenarioPool:
+    """
+    Pre-generates scenarios in background worker processes, so that resetting an
+    environment does not have to wait for the scenario generation.
+
+    The canvases are rendered into a ring of `depth` slots in shared memory. claim()
+    hands out the next ready scenario, and its slot is only re-used for a new scenario
+    after it was given back via release(). Scenario i is always generated from the
+    i-th child of the seed's SeedSequence and scenarios are handed out in order, so a
+    run is reproducible regardless of the number of workers and their timing.
+
+    The canvas_shape and render_size have to match the settings of the env using the pool.
+    """
+    def __init__(self, depth=16, num_workers=2, canvas_shape=(3, 768, 1366), render_size=None, seed=None, start_method=None):
+        seed_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+        generator_seed, scenario_seed = seed_sequence.spawn(2)
+        self.depth = depth
+        self.canvas_shape = canvas_shape
+        self.render_size = render_size
+
+        # allocate the ring of canvases in shared memory
+        slot_shape = canvas_shape if render_size is None else (canvas_shape[0], *render_size)
+        self.shm = shared_memory.SharedMemory(create=True, size=depth * int(np.prod(slot_shape)))
+        self.slots = np.ndarray((depth, *slot_shape), dtype=np.uint8, buffer=self.shm.buf)
+
+        context = mp.get_context(start_method)
+        self.task_queue = context.Queue()
+        self.ready_queue = context.Queue()
+
+        # index of the next scenario to schedule and of the next scenario to hand out
+        self._next_index = 0
+        self._next_claim = 0
+        # scenarios that were finished out of order
+        self._ready = {}
+
+        # fill all slots
+        for slot in range(depth):
+            self._schedule(slot)
+
+        self.workers = [
+            context.Process(
+                target=_scenario_worker,
+                args=(self.shm.name, self.slots.shape, canvas_shape, render_size, generator_seed, scenario_seed, self.task_queue, self.ready_queue),
+                daemon=True
+            ) for _ in range(num_workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def claim(self):
+        """
+        Return the next scenario as (slot, canvas, target_bounding_box, task_description, click_type).
+        The canvas is a view into the shared memory slot and stays valid until the slot is released.
+        """
+        while self._next_claim not in self._ready:
+            try:
+                index, slot, target_bounding_box, task_description, click_type = self.ready_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not all(worker.is_alive() for worker in self.workers):
+                    raise RuntimeError("A ScenarioPool worker died")
+                continue
+            self._ready[index] = (slot, target_bounding_box, task_description, click_type)
+
+        slot, target_bounding_box, task_description, click_type = self._ready.pop(self._next_claim)
+        self._next_claim += 1
+        return slot, self.slots[slot], target_bounding_box, task_description, click_type
+
+    def release(self, slot):
+        """
+        Give a claimed slot back to the pool, so that a new scenario can be generated into it.
+        """
+        self._schedule(slot)
+
+    def close(self):
+        """
+        Stop the workers and free the shared memory.
+        """
+        if self.workers is None:
+            return
+        for _ in self.workers:
+            self.task_queue.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5.0)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = None
+
+        del self.slots
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _schedule(self, slot):
+        self.task_queue.put((self._next_index, slot))
+        self._next_index += 1
@@ -0,0 +1,16 @@
+import argparse, os
+
+from ActionEnv import convert_icons
+
+
+# One-time conversion of data/Icons-50/Icons-50.npy into the memory-mapped store used by Icons.
+# Example: python convert_icons.py --render-size 384 640
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack the Icons-50 dataset into a memory-mappable store.")
+    parser.add_argument("--dataset-path", default=os.path.join("data", "Icons-50"))
+    parser.add_argument("--render-size", nargs=2, type=int, action="append", default=[], metavar=("H", "W"),
+                        help="observation size to pre-scale the icons for (can be given multiple times)")
+    args = parser.parse_args()
+
+    target_path = convert_icons(args.dataset_path, render_sizes=[tuple(size) for size in args.render_size])
+    print(f"Packed icons written to {target_path}")
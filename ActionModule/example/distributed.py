@@ -0,0 +1,246 @@
+import numpy as np
+
+import torch
+import torch.multiprocessing as mp
+
+from multiprocessing import shared_memory
+
+import copy, queue
+
+from inference import InferenceServer
+from ActionEnv import ActionEnv
+
+
+
+def _actor(actor_id, shared_net, version, lock, shm_name, slots_shape, free_queue, transition_queue, stop_event,
+           epsilon, seed, env_kwargs, sync_interval, threads_per_actor):
+    """
+    Actor process of the DistributedTrainer. Runs an ActionEnv with a local copy of the
+    policy, writes the observations into its shared memory slots and sends the transitions
+    to the learner.
+    """
+    torch.set_num_threads(threads_per_actor)
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    slots = np.ndarray(slots_shape, dtype=np.uint8, buffer=shm.buf)[actor_id]
+
+    env_seed, exploration_seed = seed.spawn(2)
+    env = ActionEnv(seed=env_seed, **env_kwargs)
+    rng = np.random.default_rng(exploration_seed)
+
+    # act with a private copy of the shared weights, so the learner never writes into them mid-forward
+    local_net = copy.deepcopy(shared_net)
+    local_net.eval()
+    local_version = -1
+    inference_server = InferenceServer(local_net, torch.device('cpu'), max_batch_size=1)
+
+    def get_slot():
+        while not stop_event.is_set():
+            try:
+                return free_queue.get(timeout=1.0)
+            except queue.Empty:
+                continue
+        return None
+
+    steps = 0
+    while not stop_event.is_set():
+        obs, task_description = env.reset()
+        state_slot = get_slot()
+        if state_slot is None:
+            break
+        slots[state_slot] = obs
+
+        total_reward = 0.0
+        episode_steps = 0
+        done = False
+        while not done:
+            # pick up new weights
+            if not steps % sync_interval and version.value != local_version:
+                with lock:
+                    local_net.load_state_dict(shared_net.state_dict())
+                    local_version = version.value
+
+            if rng.random() < epsilon:
+                action = int(rng.integers(0, 6))
+            else:
+                action = int(inference_server.act([slots[state_slot]], [task_description])[0])
+
+            next_obs, reward, done, info = env.step(action)
+            if done and info[0] == 1:
+                # give extra reward for clicking on target
+                reward += 50
+            steps += 1
+            episode_steps += 1
+            total_reward += reward
+
+            next_slot = get_slot()
+            if next_slot is None:
+                break
+            slots[next_slot] = next_obs
+
+            episode = (episode_steps, total_reward, info[0], info[1]) if done else None
+            transition_queue.put((actor_id, state_slot, action, reward, next_slot, done, task_description, episode))
+            state_slot = next_slot
+
+    del slots
+    shm.close()
+
+
+
+class DistributedTrainer:
+    """
+    Ape-X style actor/learner split of Agent.train.
+
+    num_actors processes step their own ActionEnv with a CPU copy of the policy network,
+    while this (learner) process only inserts their transitions into the replay memory
+    and runs the gradient steps, so env stepping and backprop overlap and collection
+    scales with the number of cores. Every actor explores with its own fixed epsilon
+    (epsilon ** (1 + alpha * i / (num_actors - 1))) and pushes into its own stream of the
+    replay memory.
+
+    The observations are written into a ring of slots_per_actor shared memory slots per
+    actor; only the slot indices go through the transition queue. A slot is handed back
+    to its actor once the learner has copied it into the replay memory, so a slow learner
+    throttles the actors. The learner publishes the policy weights into a shared CPU
+    network every publish_interval gradient steps, the actors pick them up every
+    sync_interval env steps.
+
+    The actors only use the CPU, so the default (fork) start method is fine even if the
+    learner uses CUDA. The envs have to render (384, 640, 3) observations (see env_kwargs).
+    """
+    def __init__(self, agent, num_actors=4, slots_per_actor=8, epsilon=0.4, alpha=7.0, publish_interval=50,
+                 sync_interval=100, threads_per_actor=1, env_kwargs=None, seed=None, start_method=None):
+        self.agent = agent
+        self.num_actors = num_actors
+        self.publish_interval = publish_interval
+        env_kwargs = {"observation_shape": (384, 640), "layout": "HWC", **(env_kwargs or {})}
+
+        # every actor pushes into its own stream of the replay memory
+        if agent.memory.num_streams != num_actors:
+            agent.memory = type(agent.memory)(agent.memory.capacity, num_streams=num_actors)
+
+        # the weights the actors act with
+        self.shared_net = copy.deepcopy(agent.policy_net).to('cpu')
+        self.shared_net.device = torch.device('cpu')
+        self.shared_net.token_cache.clear()
+        self.shared_net.share_memory()
+
+        context = mp.get_context(start_method)
+        self.version = context.Value('l', 0)
+        self.lock = context.Lock()
+        self.stop_event = context.Event()
+        self.transition_queue = context.Queue()
+
+        # allocate the observation slots of all actors in shared memory
+        slots_shape = (num_actors, slots_per_actor, *env_kwargs["observation_shape"], 3)
+        self.shm = shared_memory.SharedMemory(create=True, size=int(np.prod(slots_shape)))
+        self.slots = np.ndarray(slots_shape, dtype=np.uint8, buffer=self.shm.buf)
+        self.free_queues = [context.Queue() for _ in range(num_actors)]
+        for free_queue in self.free_queues:
+            for slot in range(slots_per_actor):
+                free_queue.put(slot)
+
+        seeds = (seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)).spawn(num_actors)
+        self.epsilons = [epsilon ** (1 + alpha * i / max(num_actors - 1, 1)) for i in range(num_actors)]
+        self.actors = [
+            context.Process(
+                target=_actor,
+                args=(i, self.shared_net, self.version, self.lock, self.shm.name, slots_shape, self.free_queues[i],
+                      self.transition_queue, self.stop_event, self.epsilons[i], seeds[i], env_kwargs,
+                      sync_interval, threads_per_actor),
+                daemon=True
+            ) for i in range(num_actors)
+        ]
+        for actor in self.actors:
+            actor.start()
+
+        self.episodes = 0
+        self._last_publish = agent.learn_counter
+
+    def run(self, num_env_steps, max_transitions_per_call=64):
+        """
+        Consume transitions and train until the actors made num_env_steps more steps.
+        """
+        scheduler = self.agent.scheduler
+        end = scheduler.env_steps + num_env_steps
+        while scheduler.env_steps < end:
+            # insert the new transitions
+            num_transitions = self._consume(max_transitions_per_call)
+            scheduler.step(num_transitions)
+
+            # train the model
+            n_updates = scheduler.updates_due(len(self.agent.memory))
+            if n_updates:
+                self.agent._train_step(n_updates)
+
+            # share the new weights with the actors
+            if self.agent.learn_counter - self._last_publish >= self.publish_interval:
+                self.publish()
+
+    def publish(self):
+        """
+        Copy the current policy weights into the shared network.
+        """
+        with self.lock:
+            with torch.no_grad():
+                for shared, param in zip(self.shared_net.state_dict().values(), self.agent.policy_net.state_dict().values()):
+                    shared.copy_(param)
+            self.version.value += 1
+        self._last_publish = self.agent.learn_counter
+
+    def close(self):
+        """
+        Stop the actors and free the shared memory.
+        """
+        if self.actors is None:
+            return
+        self.stop_event.set()
+        for actor in self.actors:
+            actor.join(timeout=5.0)
+            if actor.is_alive():
+                actor.terminate()
+        self.actors = None
+
+        del self.slots
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _consume(self, max_transitions):
+        """
+        Push up to max_transitions waiting transitions into the replay memory. Blocks until
+        at least one transition is available.
+        """
+        messages = []
+        while not messages:
+            try:
+                messages.append(self.transition_queue.get(timeout=1.0))
+            except queue.Empty:
+                if not all(actor.is_alive() for actor in self.actors):
+                    raise RuntimeError("A DistributedTrainer actor died")
+        while len(messages) < max_transitions:
+            try:
+                messages.append(self.transition_queue.get_nowait())
+            except queue.Empty:
+                break
+
+        for actor_id, state_slot, action, reward, next_slot, done, task_description, episode in messages:
+            slots = self.slots[actor_id]
+            self.agent.memory.push(slots[state_slot], action, reward, slots[next_slot], done, task_description, stream=actor_id)
+
+            # the state is stored now, the next state is still needed as the state of the next transition
+            self.free_queues[actor_id].put(state_slot)
+            if done:
+                self.free_queues[actor_id].put(next_slot)
+
+            if episode is not None:
+                steps, total_reward, success, final_distance = episode
+                print(f"Episode: {self.episodes}, Actor: {actor_id}, Final Distance: {final_distance}, Steps: {steps}, Total Reward: {total_reward}, Episode Reward: {success}, Epsilon: {self.epsilons[actor_id]:.4f}")
+                self.episodes += 1
+
+        return len(messages)
@@ -0,0 +1,105 @@
+import numpy as np
+
+import torch
+
+from concurrent.futures import Future
+import queue, threading, time
+
+import utils
+
+
+
+class InferenceServer:
+    """
+    Runs the action selection of many environments as batched forward passes.
+
+    Vectorized envs can call act() with all their observations at once. Independent
+    envs (e.g. one per thread) submit() single observations instead; a background
+    thread collects the requests until max_batch_size observations are queued or
+    the oldest request has waited max_wait seconds, runs one forward pass for all of
+    them and resolves the returned futures with the greedy actions.
+
+    Observations are uint8 (H, W, C) frames, as stored in the replay memory.
+    """
+    def __init__(self, model, device, max_batch_size=32, max_wait=0.005):
+        self.model = model
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+
+        self._requests = queue.Queue()
+        self._thread = None
+        self._running = False
+
+    def act(self, observations, task_descriptions):
+        """
+        Return the greedy actions for a batch of observations, in chunks of at most max_batch_size.
+        """
+        actions = [
+            self._forward(observations[start:start + self.max_batch_size], task_descriptions[start:start + self.max_batch_size])
+            for start in range(0, len(observations), self.max_batch_size)
+        ]
+        return np.concatenate(actions)
+
+    def submit(self, observation, task_description):
+        """
+        Queue a single observation. Returns a future that resolves to the greedy action.
+        """
+        if not self._running:
+            raise RuntimeError("The InferenceServer has not been started")
+        future = Future()
+        self._requests.put((observation, task_description, future))
+        return future
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._serve, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _serve(self):
+        while self._running:
+            # wait for the first request of the next batch
+            try:
+                requests = [self._requests.get(timeout=0.1)]
+            except queue.Empty:
+                continue
+
+            # collect more requests until the batch is full or the first request waited long enough
+            deadline = time.perf_counter() + self.max_wait
+            while len(requests) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                if timeout <= 0:
+                    break
+                try:
+                    requests.append(self._requests.get(timeout=timeout))
+                except queue.Empty:
+                    break
+
+            observations, task_descriptions, futures = zip(*requests)
+            try:
+                actions = self._forward(observations, task_descriptions)
+            except Exception as e:
+                for future in futures:
+                    future.set_exception(e)
+                continue
+            for future, action in zip(futures, actions):
+                future.set_result(int(action))
+
+    def _forward(self, observations, task_descriptions):
+        with torch.inference_mode():
+            frames = utils.frames_to_tensor(np.stack(observations), self.device)
+            q_values = self.model(frames, list(task_descriptions))
+        return q_values.argmax(dim=1).to('cpu').numpy()
@@ -14,8 +14,11 @@ from transformers import (
     AutoModelForSequenceClassification
 )
 
+from collections import OrderedDict
 import os, cv2
 import utils
+from inference import InferenceServer
+from distributed import DistributedTrainer
 
 
 class QFormerBlock(nn.Module):
@@ -64,7 +67,7 @@ class VLM_base(nn.Module):
     Both models are pretrained, and the positional encoding for the ViT model is 
     re-initialized to accomodate for the new resolution (1366x768x3).
     """
-    def __init__(self, action_space=6, device=torch.device('cuda')):
+    def __init__(self, action_space=6, device=torch.device('cuda'), token_cache_size=2048):
         super().__init__()
         vit = torchvision.models.vit_b_32(pretrained=True) # use 32 to reduce computational load. Still, presumeably 1008 patches
 
@@ -85,6 +88,10 @@ class VLM_base(nn.Module):
         bert = AutoModelForSequenceClassification.from_pretrained("distilbert-base-uncased")
         self.tokenizer = AutoTokenizer.from_pretrained("distilbert-base-uncased")
 
+        # LRU cache of the token ids of the task descriptions (see _tokenize)
+        self.token_cache = OrderedDict()
+        self.token_cache_size = token_cache_size
+
         # split bert into the embedder and transformer
         self.word_embeddings = bert.distilbert.embeddings.word_embeddings
         self.bert = bert
@@ -203,10 +210,10 @@ class VLM_base(nn.Module):
         img = self.q_former(img)
 
         # tokenize the text
-        text = self.tokenizer(text, padding=True, return_tensors="pt")
+        input_ids = self._tokenize(text)
 
         # get token embeddings
-        text = self.word_embeddings(text['input_ids'])
+        text = self.word_embeddings(input_ids)
 
         # concatenate the image and text
         img_text_input = torch.cat((img, text), dim=1)
@@ -224,6 +231,33 @@ class VLM_base(nn.Module):
         return value + advantage - advantage.mean()
 
     
+    def _tokenize(self, text):
+        """
+        Return the padded token ids of a (batch of) task description(s) on the device.
+
+        There are only a few hundred distinct task descriptions, so their token ids are
+        kept in an LRU cache and the tokenizer only runs for unseen descriptions. The ids
+        rather than the embeddings are cached, since the word embeddings are trained.
+        """
+        if isinstance(text, str):
+            text = [text]
+
+        input_ids = []
+        for task_description in text:
+            ids = self.token_cache.get(task_description)
+            if ids is None:
+                ids = self.tokenizer(task_description, return_tensors="pt")['input_ids'][0].to(self.device)
+                self.token_cache[task_description] = ids
+                if len(self.token_cache) > self.token_cache_size:
+                    self.token_cache.popitem(last=False)
+            else:
+                self.token_cache.move_to_end(task_description)
+            input_ids.append(ids)
+
+        # pad like the tokenizer does for a batch
+        return nn.utils.rnn.pad_sequence(input_ids, batch_first=True, padding_value=self.tokenizer.pad_token_id)
+
+    
     def _test_vit(self, x):
         """
         Test the ViT model with a dummy input
@@ -241,14 +275,15 @@ class Agent:
     This  class is a wrapper around the VLM_base class to enable
     DDQN style learning.
     """
-    def __init__(self):
+    def __init__(self, prioritized_replay=False, replay_ratio=0.25, max_updates_per_call=4, warmup=1_000,
+                 max_inference_batch_size=32, max_inference_wait=0.005):
         self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self.policy_net = VLM_base(device=self.device)
         self.target_net = VLM_base(device=self.device)
         self.target_net.load_state_dict(self.policy_net.state_dict())
 
         self.optimizer = torch.optim.Adam(self.policy_net.parameters(), lr=3e-4)
-        self.loss_fn = torch.nn.SmoothL1Loss() #nn.MSELoss()
+        self.loss_fn = torch.nn.SmoothL1Loss(reduction='none') #nn.MSELoss()
 
         self.policy_net.to(self.device)
         self.target_net.to(self.device)
@@ -263,11 +298,32 @@ class Agent:
         self.learn_counter = 0
 
 
-        # initialize Replay Memory
-        self.memory = utils.ReplayMemory(
-            capacity=10_000
+        # batches the action selection of one or many envs
+        self.inference_server = InferenceServer(
+            self.target_net,
+            self.device,
+            max_batch_size=max_inference_batch_size,
+            max_wait=max_inference_wait
         )
 
+        # schedule the gradient steps at a fixed update-to-data ratio
+        self.scheduler = utils.UpdateScheduler(
+            replay_ratio=replay_ratio,
+            max_updates_per_call=max_updates_per_call,
+            warmup=max(warmup, self.batch_size)
+        )
+
+        # initialize Replay Memory
+        self.prioritized_replay = prioritized_replay
+        if prioritized_replay:
+            self.memory = utils.PrioritizedReplayMemory(
+                capacity=10_000
+            )
+        else:
+            self.memory = utils.ReplayMemory(
+                capacity=10_000
+            )
+
     def get_action(self, state, exploration=False):
         """
         Given a state, return the action that the agent should take.
@@ -277,14 +333,22 @@ class Agent:
         else:
             return self._get_greedy_action(state)
 
+    def get_actions(self, states, task_descriptions, exploration=False):
+        """
+        Batched version of get_action for many envs (e.g. a BatchedActionEnv), using a
+        single forward pass for all states.
+        """
+        actions = self.inference_server.act(states, task_descriptions)
+        if exploration:
+            explore = np.random.rand(len(actions)) < self.epsilon
+            actions[explore] = np.random.randint(0, 6, size=explore.sum())
+        return actions
+
     def _get_greedy_action(self, state):
         """
         Given a state, return the greedy action that the agent should take.
         """
-        #state = state #torch.tensor(state, dtype=torch.float).unsqueeze(0).to(self.device)
-        q_values = self.target_net(state, self.task_description) 
-        action = torch.argmax(q_values).to('cpu').item()
-        return action
+        return int(self.inference_server.act([state], [self.task_description])[0])
     
     def _decay_epsilon(self):
         """
@@ -306,7 +370,7 @@ class Agent:
             # reset the environment 
             obs, self.task_description = env.reset()
             # convert to cv2 and resize obs 
-            obs = cv2.resize(obs.transpose(1,2,0), dsize=(640, 384))#.transpose(2,0,1)
+            obs = self._process_observation(obs)
             # transform the observation
             state = obs #utils.process_state(obs)
             total_reward = 0.0 
@@ -319,7 +383,7 @@ class Agent:
 
                 # take the action
                 next_obs, reward, done, info = env.step(action)
-                next_obs = cv2.resize(next_obs.transpose(1,2,0), dsize=(640, 384))#.transpose(2,0,1)
+                next_obs = self._process_observation(next_obs)
 
                 if done and info[0] == 1:
                     # give extra reward for clicking on target
@@ -328,16 +392,8 @@ class Agent:
                 # transform the observation
                 next_state = next_obs # utils.process_state(next_obs)
 
-                # add the transition to the replay memory (convert to tensors first)
-                self.memory.push(
-                    transforms.ToTensor()(state).unsqueeze(0), #torch.from_numpy(state).float().unsqueeze(0), 
-                    torch.tensor([action]), 
-                    torch.tensor([reward]),
-                    transforms.ToTensor()(next_state).unsqueeze(0), #torch.from_numpy(next_state).float().unsqueeze(0), 
-                    torch.tensor([done], dtype=torch.int), 
-                    self.task_description
-                )
-                #self.memory.push(state, action, reward, next_state, done, self.task_description)
+                # add the transition to the replay memory (the uint8 frames are copied into its arrays)
+                self.memory.push(state, action, reward, next_state, done, self.task_description)
 
                 # update the state
                 state = next_state
@@ -346,8 +402,10 @@ class Agent:
                 total_reward += reward
 
                 # train the model
-                if not steps_done%10:
-                    self._train_step()
+                self.scheduler.step()
+                n_updates = self.scheduler.updates_due(len(self.memory))
+                if n_updates:
+                    self._train_step(n_updates)
 
 
 
@@ -355,7 +413,8 @@ class Agent:
                 if done:
                     # store the results in tracker df, print & break
                     tracker_df.loc[len(tracker_df)] = [episode, steps_done, total_reward, info[0], info[1], self.epsilon]
-                    print(f"Episode: {episode}, Final Distance: {info[1]}, Steps: {steps_done}, Total Reward: {total_reward}, Episode Reward: {info[0]}, Epsilon: {self.epsilon}")
+                    rates = self.scheduler.rates()
+                    print(f"Episode: {episode}, Final Distance: {info[1]}, Steps: {steps_done}, Total Reward: {total_reward}, Episode Reward: {info[0]}, Epsilon: {self.epsilon}, Env Steps/s: {rates['env_steps_per_sec']:.1f}, Updates/s: {rates['updates_per_sec']:.2f}")
                     # decay epsilon
                     self._decay_epsilon()
                     break
@@ -365,25 +424,51 @@ class Agent:
             tracker_df.to_csv(os.path.join("results", "tracker_df.csv"))
 
 
-    def _train_step(self):
+    def train_distributed(self, num_env_steps, num_actors=4, **kwargs):
+        """
+        Train with num_actors actor processes collecting the experience in parallel
+        (see distributed.DistributedTrainer for the keyword arguments).
+        """
+        with DistributedTrainer(self, num_actors=num_actors, **kwargs) as trainer:
+            trainer.run(num_env_steps)
+
+
+    def _process_observation(self, obs):
+        """
+        Bring the observation into the (384, 640, 3) format expected by the model. Envs
+        created with observation_shape=(384, 640) and layout="HWC" already render at
+        that resolution, in which case nothing has to be done.
+        """
+        if obs.shape == (384, 640, 3):
+            return obs
+        return cv2.resize(obs.transpose(1,2,0), dsize=(640, 384))
+
+
+    def _train_step(self, n_iter=1):
+        """
+        Run n_iter gradient steps on batches sampled from the replay memory.
+        """
         # check if enough items in memory
         if len(self.memory) < self.batch_size:
             return
         
 
         avg_loss = 0
-        n_iter = int(len(self.memory)/self.batch_size)
         for i in range(n_iter):
             # sample batch from memory 
-            state, action, reward, state_, done, task_desc = self.memory.sample(self.batch_size)
-
-            # convert to tensors and concatenate
-            state = torch.cat(state).to(self.device)
-            action = torch.cat(action).to(self.device)
-            state_ = torch.cat(state_).to(self.device)
-            reward = torch.cat(reward).to(self.device)
-            done = torch.tensor(done, dtype=torch.int).to(self.device)
-            #task_desc = torch.cat(task_desc).to(self.device)
+            if self.prioritized_replay:
+                batch, indices, weights = self.memory.sample(self.batch_size)
+                weights = weights.to(self.device)
+            else:
+                batch = self.memory.sample(self.batch_size)
+            state, action, reward, state_, done, task_desc = batch
+
+            # move to device and convert the frames
+            state = utils.frames_to_tensor(state, self.device)
+            action = action.to(self.device)
+            state_ = utils.frames_to_tensor(state_, self.device)
+            reward = reward.to(self.device)
+            done = done.to(self.device)
 
             q = self.policy_net(state, task_desc).gather(1, action.view(-1, 1))   
             qmax = self.target_net(state_, task_desc).max(dim=1)[0].detach()
@@ -394,6 +479,12 @@ class Agent:
             q_target = (1 - done) * nonterminal_target + done * terminal_target
 
             loss = self.loss_fn(q.view(-1), q_target)
+            if self.prioritized_replay:
+                # correct the bias of the prioritized sampling and update the priorities with the new TD errors
+                loss = (loss * weights).mean()
+                self.memory.update_priorities(indices, (q.view(-1) - q_target).detach().cpu().numpy())
+            else:
+                loss = loss.mean()
             avg_loss += loss.item()
             # Perform backward propagation and optimization step
             self.optimizer.zero_grad()
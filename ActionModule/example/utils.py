@@ -1,34 +1,282 @@
-from collections import namedtuple 
-import random, torch 
-import numpy as np 
+from collections import namedtuple
+import time, torch
+import numpy as np
 
 
-Transition = namedtuple('Transion', 
+Transition = namedtuple('Transion',
                         ('state', 'action', 'reward', 'next_state', 'done', 'task_desc'))
 
 class ReplayMemory(object):
-    def __init__(self, capacity):
+    """
+    Ring buffer of transitions, backed by preallocated numpy arrays.
+
+    Every frame is stored only once (as given, e.g. uint8 HWC): the next_state of a
+    transition is the frame that follows its state in the buffer, so pushing the
+    transitions of an episode in order costs one frame per transition. The next
+    state of a terminal transition is overwritten by the first state of the next
+    episode, which is fine since it is masked out of the DQN target anyway.
+
+    Transitions have to be pushed in order within a stream. Producers that interleave
+    several episodes (e.g. multiple actors) push into separate streams, each of which
+    owns capacity // num_streams slots of the buffer.
+
+    Task descriptions are interned, so only an integer id is stored per transition.
+    """
+    def __init__(self, capacity, num_streams=1):
         self.capacity = capacity
-        self.memory = []
-        self.position = 0
-        
-    def push(self, *args):
-        if len(self.memory) < self.capacity:
-            self.memory.append(None)
-        self.memory[self.position] = Transition(*args)
-        self.position = (self.position + 1) % self.capacity
-        
+        self.num_streams = num_streams
+        self.stream_capacity = capacity // num_streams
+
+        # transition data, one row per stream
+        shape = (num_streams, self.stream_capacity)
+        self.actions = np.zeros(shape, dtype=np.int64)
+        self.rewards = np.zeros(shape, dtype=np.float32)
+        self.dones = np.zeros(shape, dtype=np.int64)
+        self.task_ids = np.zeros(shape, dtype=np.int32)
+
+        # the frames are allocated on the first push, once their shape is known.
+        # Every stream has one frame more than transitions for the latest next_state
+        self.frames = None
+
+        # number of transitions pushed to every stream, and whether the last one was terminal
+        self.counters = np.zeros(num_streams, dtype=np.int64)
+        self.last_done = np.ones(num_streams, dtype=bool)
+
+        self.task_descriptions = []
+        self._task_ids = {}
+
+    def push(self, state, action, reward, next_state, done, task_desc, stream=0):
+        if self.frames is None:
+            state = np.asarray(state)
+            self.frames = np.zeros((self.num_streams, self.stream_capacity + 1, *state.shape), dtype=state.dtype)
+
+        counter = self.counters[stream]
+        slot = counter % self.stream_capacity
+        frame = counter % (self.stream_capacity + 1)
+
+        # within an episode the state was already stored as the previous next_state
+        if self.last_done[stream]:
+            self.frames[stream, frame] = state
+        self.frames[stream, (frame + 1) % (self.stream_capacity + 1)] = next_state
+
+        self.actions[stream, slot] = action
+        self.rewards[stream, slot] = reward
+        self.dones[stream, slot] = done
+        self.task_ids[stream, slot] = self._get_task_id(task_desc)
+
+        self.counters[stream] += 1
+        self.last_done[stream] = bool(done)
+
     def sample(self, batch_size):
-        batch = random.sample(self.memory, batch_size)
+        indices = np.random.choice(len(self), batch_size, replace=False)
+        return self.get_batch(indices)
 
-        # Converts batch of transitions to transitions of batches
-        batch = Transition(*zip(*batch))
-        return batch
+    def get_batch(self, indices):
+        """
+        Gather the transitions at the given (flat) indices into batched tensors. The frames
+        are returned as they were stored, use frames_to_tensor to convert them for the model.
+        """
+        streams, slots = self._unravel(indices)
+        return self._get_batch(streams, slots)
 
     def __len__(self):
-        return len(self.memory)
-    
+        return int(np.minimum(self.counters, self.stream_capacity).sum())
+
+    def _get_batch(self, streams, slots):
+        state_frames, next_frames = self._get_frames(streams, slots)
+
+        # Converts batch of transitions to transitions of batches
+        return Transition(
+            torch.from_numpy(self.frames[streams, state_frames]),
+            torch.from_numpy(self.actions[streams, slots]),
+            torch.from_numpy(self.rewards[streams, slots]),
+            torch.from_numpy(self.frames[streams, next_frames]),
+            torch.from_numpy(self.dones[streams, slots]),
+            [self.task_descriptions[task_id] for task_id in self.task_ids[streams, slots]]
+        )
+
+    def _get_task_id(self, task_desc):
+        if task_desc not in self._task_ids:
+            self._task_ids[task_desc] = len(self.task_descriptions)
+            self.task_descriptions.append(task_desc)
+        return self._task_ids[task_desc]
+
+    def _unravel(self, indices):
+        """
+        Map flat indices in [0, len(self)) onto (stream, slot) pairs.
+        """
+        sizes = np.minimum(self.counters, self.stream_capacity)
+        starts = np.cumsum(sizes) - sizes
+        streams = np.searchsorted(starts, indices, side='right') - 1
+        return streams, indices - starts[streams]
+
+    def _get_frames(self, streams, slots):
+        """
+        Get the frame indices of the states and next states of the given slots.
+        """
+        # global index of the transition in its stream; the slot was last written
+        # in the most recent pass over the ring
+        counters = self.counters[streams]
+        transition = counters - 1 - (counters - 1 - slots) % self.stream_capacity
+        state_frames = transition % (self.stream_capacity + 1)
+        return state_frames, (state_frames + 1) % (self.stream_capacity + 1)
+
+class SumTree(object):
+    """
+    Array-backed binary tree in which every inner node holds the sum of its two children.
+    The leaves hold the priorities, so updating a priority and finding the leaf for a
+    given prefix sum are both O(log n). All operations work on whole batches at once.
+    """
+    def __init__(self, capacity):
+        # round up to a power of two, so that all leaves are on the same level
+        self.capacity = 1 << max(0, int(capacity - 1).bit_length())
+        self.tree = np.zeros(2 * self.capacity)
+
+    def total(self):
+        return self.tree[1]
+
+    def get(self, indices):
+        return self.tree[np.asarray(indices) + self.capacity]
+
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices) + self.capacity
+        self.tree[nodes] = priorities
+
+        # recompute the sums level by level up to the root
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        """
+        Return the indices of the leaves in which the given prefix sums fall.
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones(len(values), dtype=np.int64)
+        while nodes[0] < self.capacity:
+            left = 2 * nodes
+            go_right = values >= self.tree[left]
+            values = np.where(go_right, values - self.tree[left], values)
+            nodes = np.where(go_right, left + 1, left)
+        return nodes - self.capacity
+
+class PrioritizedReplayMemory(ReplayMemory):
+    """
+    Proportional prioritized experience replay (Schaul et al., 2016) on top of the
+    array-backed ReplayMemory. New transitions get the maximum priority seen so far,
+    sampling is stratified over the sum-tree and the importance-sampling weights are
+    annealed from beta to 1.
+    """
+    def __init__(self, capacity, num_streams=1, alpha=0.6, beta=0.4, beta_increment=1e-4, epsilon=1e-6):
+        super().__init__(capacity, num_streams)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.max_priority = 1.0
+
+        # one leaf per (stream, slot)
+        self.tree = SumTree(self.num_streams * self.stream_capacity)
+
+    def push(self, state, action, reward, next_state, done, task_desc, stream=0):
+        slot = self.counters[stream] % self.stream_capacity
+        super().push(state, action, reward, next_state, done, task_desc, stream=stream)
+        self.tree.update([stream * self.stream_capacity + slot], [self.max_priority ** self.alpha])
+
+    def sample(self, batch_size):
+        """
+        Returns the batch, the indices of the sampled transitions (for update_priorities)
+        and their normalized importance-sampling weights.
+        """
+        # draw one value from each of batch_size equally sized segments of the total priority
+        total = self.tree.total()
+        values = (np.arange(batch_size) + np.random.random(batch_size)) * (total / batch_size)
+        indices = self.tree.find(np.minimum(values, np.nextafter(total, 0)))
+
+        # importance-sampling weights, normalized by their maximum
+        probabilities = self.tree.get(indices) / total
+        weights = (len(self) * probabilities) ** (-self.beta)
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        batch = self._get_batch(indices // self.stream_capacity, indices % self.stream_capacity)
+        return batch, indices, torch.from_numpy(weights.astype(np.float32))
+
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities ** self.alpha)
+
+class UpdateScheduler(object):
+    """
+    Decides how many gradient steps to run, so that the number of updates per env step
+    stays at a fixed update-to-data (replay) ratio, independent of the size of the
+    replay memory. No updates happen before the memory holds `warmup` transitions,
+    and at most max_updates_per_call updates are scheduled at once (surplus credit
+    is dropped rather than accumulated into a backlog).
+
+    The scheduler also keeps track of the achieved env steps and updates per second.
+    """
+    def __init__(self, replay_ratio=0.25, max_updates_per_call=4, warmup=1_000):
+        self.replay_ratio = replay_ratio
+        self.max_updates_per_call = max_updates_per_call
+        self.warmup = warmup
+
+        self.env_steps = 0
+        self.updates = 0
+        self._credit = 0.0
+
+        self._last_time = time.perf_counter()
+        self._last_env_steps = 0
+        self._last_updates = 0
+
+    def step(self, num_steps=1):
+        """
+        Register env steps.
+        """
+        self.env_steps += num_steps
+        self._credit = min(self._credit + num_steps * self.replay_ratio, self.max_updates_per_call)
+
+    def updates_due(self, memory_size):
+        """
+        Return the number of gradient steps to run now.
+        """
+        if memory_size < self.warmup:
+            self._credit = 0.0
+            return 0
+
+        num_updates = int(self._credit)
+        self._credit -= num_updates
+        self.updates += num_updates
+        return num_updates
+
+    def rates(self):
+        """
+        Return the env steps and updates per second since the last call.
+        """
+        now = time.perf_counter()
+        elapsed = max(now - self._last_time, 1e-9)
+        rates = {
+            "env_steps_per_sec": (self.env_steps - self._last_env_steps) / elapsed,
+            "updates_per_sec": (self.updates - self._last_updates) / elapsed,
+        }
+        self._last_time = now
+        self._last_env_steps = self.env_steps
+        self._last_updates = self.updates
+        return rates
+
 def process_state(obs):
     state = np.array(obs)
     state = torch.from_numpy(state)
-    return state.unsqueeze(0)
\ No newline at end of file
+    return state.unsqueeze(0)
+
+def frames_to_tensor(frames, device):
+    """
+    Convert a batch of uint8 (N, H, W, C) frames into a float (N, C, H, W) tensor in [0, 1]
+    on the given device. The frames are moved to the device before converting them, so only
+    the uint8 data is transferred.
+    """
+    if not isinstance(frames, torch.Tensor):
+        frames = torch.from_numpy(np.asarray(frames))
+    return frames.to(device, non_blocking=True).permute(0, 3, 1, 2).float().div_(255)
@@ -1,7 +1,10 @@
 from example import models, action_environment
 
 # load env 
-env = action_environment.ActionEnv()
+env = action_environment.ActionEnv(
+    observation_shape=(384, 640),
+    layout="HWC"
+)
 
 # load agent
 agent = models.Agent()